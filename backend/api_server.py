@@ -1,14 +1,26 @@
+import asyncio
+import difflib
+import hashlib
+import math
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from collections.abc import AsyncIterator
+from fastapi import BackgroundTasks, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import ollama
-import json
+import orjson
 import logging
 import aiosqlite
+import httpx
 import os
+import re
+import string
+import time
 from pathlib import Path
-from playwright.async_api import async_playwright, Browser, Page, TimeoutError as PlaywrightTimeout
+from urllib.parse import quote
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, TimeoutError as PlaywrightTimeout
 from dotenv import load_dotenv
 
 # Load environment variables from root directory
@@ -38,9 +50,13 @@ logger = logging.getLogger("api_server")
 DB_PATH = os.getenv("DB_PATH", "conversations.db")
 PROMPTS_FILE = Path("prompts.json")
 MODEL = os.getenv("OLLAMA_MODEL", "granite3.1-dense:8b")
+# Short classification prompts (confirm / follow-up / typo) can run on a small quantized model
+CLASSIFIER_MODEL = os.getenv("OLLAMA_CLASSIFIER_MODEL", MODEL)
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "24h")   # keep weights resident between requests
 MAX_QUERY_LENGTH = int(os.getenv("MAX_QUERY_LENGTH", "500"))
-WIKIPEDIA_BASE = os.getenv("WIKIPEDIA_BASE", "https://www.wikipedia.org")
+WIKIPEDIA_BASE = os.getenv("WIKIPEDIA_BASE", "https://en.wikipedia.org")
+WIKIPEDIA_TIMEOUT = float(os.getenv("WIKIPEDIA_TIMEOUT", "10"))
 HOST = os.getenv("HOST", "127.0.0.1")
 PORT = int(os.getenv("PORT", "8000"))
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
@@ -48,6 +64,19 @@ BROWSER_HEADLESS = os.getenv("BROWSER_HEADLESS", "false").lower() == "true"
 BROWSER_TIMEOUT = int(os.getenv("BROWSER_TIMEOUT", "15000"))
 PAGE_TIMEOUT = int(os.getenv("PAGE_TIMEOUT", "10000"))
 ACTION_TIMEOUT = int(os.getenv("ACTION_TIMEOUT", "5000"))
+MAX_DOM_ELEMENTS = int(os.getenv("MAX_DOM_ELEMENTS", "300"))
+PAGE_POOL_SIZE = int(os.getenv("PAGE_POOL_SIZE", "2"))
+MAX_SESSION_PAGES = int(os.getenv("MAX_SESSION_PAGES", "8"))
+CLASSIFY_CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", "2048"))
+WIKI_CACHE_SIZE = int(os.getenv("WIKI_CACHE_SIZE", "2048"))
+WIKI_CACHE_TTL = float(os.getenv("WIKI_CACHE_TTL", "3600"))
+WIKI_CONTEXT_TOKENS = int(os.getenv("WIKI_CONTEXT_TOKENS", "1024"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2048"))
+SUMMARY_EVERY_TURNS = int(os.getenv("SUMMARY_EVERY_TURNS", "4"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+# Optional embedding model (e.g. nomic-embed-text) — enables matching reworded repeat questions
+EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
 
 # ─────────────────────────────────────────────
 # Prompt cache (loaded once at startup)
@@ -55,13 +84,38 @@ ACTION_TIMEOUT = int(os.getenv("ACTION_TIMEOUT", "5000"))
 _prompts_cache: dict = {}
 
 
+def compile_template(template: str) -> list[tuple[str, str | None]]:
+    """Split a str.format template into (literal, field) segments once, so rendering is a join.
+
+    Rendering only substitutes plain names, so conversions, format specs and
+    attribute/index lookups are rejected rather than silently dropped.
+    """
+    segments = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        if field is not None and (spec or conversion or not field.isidentifier()):
+            raise ValueError(f"placeholder {{{field}}} uses a conversion, format spec or lookup")
+        segments.append((literal, field))
+    return segments
+
+
 def load_prompts() -> dict:
-    """Load and cache prompts from JSON file."""
+    """Load, compile and cache prompts from JSON file; raise ValueError on a malformed prompt."""
     global _prompts_cache
     if not _prompts_cache:
         if PROMPTS_FILE.exists():
-            _prompts_cache = json.loads(PROMPTS_FILE.read_text())
-            logger.info(f"Loaded {len(_prompts_cache)} prompts")
+            prompts = orjson.loads(PROMPTS_FILE.read_bytes())
+            for name, prompt in prompts.items():
+                try:
+                    prompt["segments"] = compile_template(prompt["template"])
+                except ValueError as e:
+                    raise ValueError(f"Prompt '{name}': {e}") from None
+                fields = {field for _, field in prompt["segments"] if field is not None}
+                if fields != set(prompt.get("variables", [])):
+                    raise ValueError(
+                        f"Prompt '{name}' declares {sorted(prompt.get('variables', []))} but uses {sorted(fields)}"
+                    )
+            _prompts_cache = prompts
+            logger.info("Loaded %s prompts", len(_prompts_cache))
         else:
             logger.error("prompts.json not found")
     return _prompts_cache
@@ -71,91 +125,270 @@ def get_prompt(prompt_name: str, **variables) -> str:
     """Return a filled prompt template."""
     prompts = load_prompts()
     if prompt_name not in prompts:
-        logger.error(f"Prompt '{prompt_name}' not found")
+        logger.error("Prompt '%s' not found", prompt_name)
         return ""
-    template = prompts[prompt_name]["template"]
+    parts = []
     try:
-        return template.format(**variables)
+        for literal, field in prompts[prompt_name]["segments"]:
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(variables[field]))
     except KeyError as e:
-        logger.error(f"Missing variable {e} for prompt '{prompt_name}'")
+        logger.error("Missing variable %s for prompt '%s'", e, prompt_name)
         return ""
+    return "".join(parts)
+
+
+# Async client so LLM calls never block the event loop and can run concurrently
+# (set OLLAMA_NUM_PARALLEL>=3 on the Ollama server to actually serve them in parallel)
+ollama_client = ollama.AsyncClient(host=OLLAMA_HOST)
 
 
-def llm(prompt: str, messages: list | None = None) -> str:
-    """Call the LLM. Optionally pass a full message list for multi-turn conversations."""
+async def llm(
+    prompt: str, messages: list | None = None, json_mode: bool = False, model: str = MODEL
+) -> str:
+    """Call the LLM. Optionally pass a full message list for multi-turn conversations.
+
+    json_mode constrains the output to valid JSON via Ollama's structured output.
+    """
     if messages is None:
         messages = [{"role": "user", "content": prompt}]
-    
-    # Configure Ollama client if custom host is specified
-    client = ollama.Client(host=OLLAMA_HOST) if OLLAMA_HOST != "http://localhost:11434" else ollama
-    response = client.chat(model=MODEL, messages=messages, stream=False)
+    response = await ollama_client.chat(
+        model=model, messages=messages, stream=False, format="json" if json_mode else None,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+    )
     return response["message"]["content"]
 
 
+async def llm_stream(messages: list) -> AsyncIterator[str]:
+    """Stream the LLM reply chunk by chunk as Ollama decodes it."""
+    async for part in await ollama_client.chat(
+        model=MODEL, messages=messages, stream=True, keep_alive=OLLAMA_KEEP_ALIVE
+    ):
+        yield part["message"]["content"]
+
+
+async def warm_up_model():
+    """Generate a single token per model so weights are loaded before the first request."""
+    for model in dict.fromkeys((MODEL, CLASSIFIER_MODEL)):
+        try:
+            await ollama_client.chat(
+                model=model,
+                messages=[{"role": "user", "content": "hi"}],
+                options={"num_predict": 1},
+                keep_alive=OLLAMA_KEEP_ALIVE,
+            )
+            logger.info("Model %s loaded", model)
+        except Exception as e:
+            logger.warning("Model warm-up failed for %s, first request will load it: %s", model, e)
+
+
 # ─────────────────────────────────────────────
-# Global browser state (single-user assumption)
+# Global browser state (one connected page per session)
 # ─────────────────────────────────────────────
 browser: Browser | None = None
-current_page: Page | None = None          # renamed to avoid shadowing builtins
+browser_context: BrowserContext | None = None   # shared so HTTP/DNS caches survive between pages
+session_pages: OrderedDict[str, Page] = OrderedDict()   # session_id → connected page, least recently used first
 playwright_instance = None
+page_pool: list[Page] = []                # warm about:blank pages ready for reuse
 
 
 async def get_or_create_browser() -> Browser:
-    """Lazily initialize the browser."""
-    global browser, playwright_instance
+    """Lazily initialize the browser, its shared context and the warm page pool."""
+    global browser, browser_context, playwright_instance
     if not playwright_instance:
         playwright_instance = await async_playwright().start()
         browser = await playwright_instance.chromium.launch(headless=BROWSER_HEADLESS)
-        logger.info(f"Browser launched (headless={BROWSER_HEADLESS})")
+        browser_context = await browser.new_context()
+        page_pool.extend([await browser_context.new_page() for _ in range(PAGE_POOL_SIZE)])
+        logger.info("Browser launched (headless=%s, pool=%s)", BROWSER_HEADLESS, PAGE_POOL_SIZE)
     return browser
 
 
-async def new_page() -> Page:
-    """Open a fresh page, closing the previous one to avoid leaks."""
-    global current_page
-    b = await get_or_create_browser()
-    if current_page:
-        try:
-            await current_page.close()
-        except Exception:
-            pass
-    current_page = await b.new_page()
-    return current_page
+async def acquire_page() -> Page:
+    """Take a warm page from the pool (or open a new one) reset to about:blank."""
+    await get_or_create_browser()
+    while page_pool:
+        page = page_pool.pop()
+        if not page.is_closed():
+            await page.goto("about:blank")
+            return page
+    return await browser_context.new_page()
+
+
+async def release_page(page: Page):
+    """Return a page to the pool, closing it instead if the pool is already full."""
+    if len(page_pool) < PAGE_POOL_SIZE and not page.is_closed():
+        page_pool.append(page)
+        return
+    try:
+        await page.close()
+    except Exception:
+        pass
+
+
+async def new_page(session_id: str) -> Page:
+    """Give a session a fresh connected page, returning its old page to the pool.
+
+    Past MAX_SESSION_PAGES the least recently used session loses its page.
+    """
+    if old := session_pages.pop(session_id, None):
+        await release_page(old)
+    page = session_pages[session_id] = await acquire_page()
+    while len(session_pages) > MAX_SESSION_PAGES:
+        _, evicted = session_pages.popitem(last=False)
+        await release_page(evicted)
+    return page
+
+
+def get_session_page(session_id: str) -> Page | None:
+    """Return the session's connected page (marking it recently used), if it is still open."""
+    page = session_pages.get(session_id)
+    if page is None or page.is_closed():
+        session_pages.pop(session_id, None)
+        return None
+    session_pages.move_to_end(session_id)
+    return page
+
+
+# ─────────────────────────────────────────────
+# Wikipedia (HTTP APIs — no browser needed)
+# ─────────────────────────────────────────────
+http_client: httpx.AsyncClient | None = None   # created in lifespan, reused for connection pooling
+
+# Normalized query → (expires_at, extract); the same topics recur across users
+_wiki_cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+
+async def fetch_wikipedia(query: str) -> str:
+    """Return the summary extract for a query, serving repeats from a TTL cache."""
+    key = query.lower().strip()
+    cached = _wiki_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        _wiki_cache.move_to_end(key)
+        logger.info("Wikipedia cache hit for '%s'", query)
+        return cached[1]
+
+    content = await fetch_wikipedia_extract(query)
+    if content:   # don't pin "not found" answers for an hour
+        _wiki_cache[key] = (time.monotonic() + WIKI_CACHE_TTL, content)
+        _wiki_cache.move_to_end(key)
+        while len(_wiki_cache) > WIKI_CACHE_SIZE:
+            _wiki_cache.popitem(last=False)
+    return content
+
+
+async def fetch_wikipedia_extract(query: str) -> str:
+    """Resolve a query to an article via OpenSearch and return the article's summary extract."""
+    search = await http_client.get(
+        f"{WIKIPEDIA_BASE}/w/api.php",
+        params={"action": "opensearch", "search": query, "limit": 1, "namespace": 0,
+                "redirects": "resolve", "format": "json"},
+    )
+    search.raise_for_status()
+    titles = orjson.loads(search.content)[1]
+    if not titles:
+        return ""
+
+    title = quote(titles[0].replace(" ", "_"), safe="")
+    summary = await http_client.get(f"{WIKIPEDIA_BASE}/api/rest_v1/page/summary/{title}")
+    summary.raise_for_status()
+    logger.info("Wikipedia article for '%s': %s", query, titles[0])
+    return orjson.loads(summary.content).get("extract", "")
 
 
 # ─────────────────────────────────────────────
 # Database helpers
 # ─────────────────────────────────────────────
+# One connection for the app's lifetime: no per-request open/close, and SQLite's
+# page cache survives between queries. Opened by init_db(), closed in lifespan.
+db: aiosqlite.Connection | None = None
+db_write_lock = asyncio.Lock()   # SQLite allows one writer; queue writes here instead of on its lock
+
+SQLITE_PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",  # only takes effect on a new file, so it must run first
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",      # wait up to 5s on a locked file instead of failing
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",      # 64 MB page cache
+    "PRAGMA mmap_size=268435456",    # 256 MB memory-mapped reads
+)
+
+
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id        INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT    NOT NULL,
-                role      TEXT    NOT NULL,
-                content   TEXT    NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+    global db
+    db = await aiosqlite.connect(DB_PATH)
+    db.row_factory = aiosqlite.Row
+    for pragma in SQLITE_PRAGMAS:
+        await db.execute(pragma)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT    NOT NULL,
+            role      TEXT    NOT NULL,
+            content   TEXT    NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # History lookups filter on session_id and walk id backwards — serve both from one B-tree
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id DESC)"
+    )
+    # Rolling summary of everything up to upto_id; newer messages are sent verbatim
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS summaries (
+            session_id TEXT    PRIMARY KEY,
+            content    TEXT    NOT NULL,
+            upto_id    INTEGER NOT NULL
+        )
+    """)
+    await db.commit()
+
+
+async def get_session_history(session_id: str, limit: int = 6, after_id: int = 0) -> list[dict]:
+    async with db.execute(
+        "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+        (session_id, after_id, limit),
+    ) as cursor:
+        rows = await cursor.fetchall()
+        return [{"id": row["id"], "role": row["role"], "content": row["content"]} for row in reversed(rows)]
+
+
+async def save_messages(session_id: str, rows: list[tuple[str, str]]):
+    """Insert (role, content) rows for a session in one transaction — one commit per turn."""
+    async with db_write_lock:
+        await db.executemany(
+            "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+            [(session_id, role, content) for role, content in rows],
+        )
+        await db.commit()
+
+
+async def delete_session_history(session_id: str):
+    async with db_write_lock:
+        await db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        await db.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
         await db.commit()
+        # Hand back up to 64 freed pages to the OS without a full, blocking VACUUM.
+        # executescript steps the pragma to completion; execute() would free a single page.
+        await db.executescript("PRAGMA incremental_vacuum(64);")
 
 
-async def get_session_history(session_id: str, limit: int = 6) -> list[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
-            (session_id, limit),
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [{"role": row["role"], "content": row["content"]} for row in reversed(rows)]
+async def get_session_summary(session_id: str) -> tuple[str, int] | None:
+    """Return (summary, upto_id) for a session, or None if it has not been summarized yet."""
+    async with db.execute(
+        "SELECT content, upto_id FROM summaries WHERE session_id = ?", (session_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        return (row["content"], row["upto_id"]) if row else None
 
 
-async def save_message(session_id: str, role: str, content: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+async def save_session_summary(session_id: str, content: str, upto_id: int):
+    async with db_write_lock:
         await db.execute(
-            "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
-            (session_id, role, content),
+            "INSERT OR REPLACE INTO summaries (session_id, content, upto_id) VALUES (?, ?, ?)",
+            (session_id, content, upto_id),
         )
         await db.commit()
 
@@ -165,14 +398,25 @@ async def save_message(session_id: str, role: str, content: str):
 # ─────────────────────────────────────────────
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global http_client
     await init_db()
+    http_client = httpx.AsyncClient(
+        timeout=WIKIPEDIA_TIMEOUT,
+        follow_redirects=True,
+        headers={"User-Agent": "MediSimpleGPT/0.1 (medical information assistant)"},
+    )
     load_prompts()          # warm the cache
+    await warm_up_model()   # pay the model load at startup, not on the first /chat
     logger.info("Startup complete")
     yield
     # Cleanup
-    global browser, playwright_instance, current_page
-    if current_page:
-        await current_page.close()
+    global browser, playwright_instance
+    if db:
+        await db.close()
+    if http_client:
+        await http_client.aclose()
+    if browser_context:
+        await browser_context.close()     # also closes session and pooled pages
     if browser:
         await browser.close()
     if playwright_instance:
@@ -205,34 +449,520 @@ class TaskRequest(BaseModel):
 class ExecuteRequest(BaseModel):
     actions: str
     url: str
+    session_id: str = "default"
 
 
 # ─────────────────────────────────────────────
 # DOM extraction helper
 # ─────────────────────────────────────────────
-DOM_SCRIPT = """() => {
+DOM_SCRIPT = """(max) => {
+    const nodes = document.querySelectorAll('a, button, input, textarea, select, li');
+    const FIELDS = ['type', 'id', 'name', 'placeholder', 'ariaLabel'];
     const elements = [];
-    document.querySelectorAll('a, button, input, textarea, select, li').forEach((el, idx) => {
-        const rect = el.getBoundingClientRect();
-        if (rect.width > 0 && rect.height > 0) {
-            elements.push({
-                index: idx,
-                tag: el.tagName,
-                text: el.innerText?.slice(0, 80) || el.value || '',
-                type: el.type || '',
-                id: el.id || '',
-                name: el.name || '',
-                class: el.className || '',
-                placeholder: el.placeholder || '',
-                href: el.href || '',
-                ariaLabel: el.ariaLabel || '',
-            });
-        }
-    });
-    return elements;
+    for (let idx = 0; idx < nodes.length && elements.length < max; idx++) {
+        const el = nodes[idx];
+        // Zero offset size means hidden/collapsed; cheaper than getBoundingClientRect()
+        if (el.offsetWidth === 0 || el.offsetHeight === 0) continue;
+        const item = { index: idx, tag: el.tagName };
+        // textContent avoids the layout flush innerText forces on every read
+        const text = (el.textContent || '').slice(0, 200).replace(/\\s+/g, ' ').trim().slice(0, 80) || el.value;
+        if (text) item.text = text;
+        // Empty fields are left out so they never cross CDP or reach the planning prompt
+        for (const key of FIELDS) if (el[key]) item[key] = el[key];
+        if (typeof el.className === 'string' && el.className) item.class = el.className;
+        if (el.tagName === 'A' && el.href) item.href = el.href;
+        elements.push(item);
+    }
+    // One string crosses CDP instead of a deeply nested object
+    return JSON.stringify(elements);
 }"""
 
 
+# ─────────────────────────────────────────────
+# Browser actions (/execute dispatch table)
+# ─────────────────────────────────────────────
+async def _do_fill(page: Page, action: dict) -> str:
+    await page.locator(action["selector"]).fill(action.get("value", ""), timeout=ACTION_TIMEOUT)
+    return f"[OK] Filled '{action['selector']}' with '{action.get('value', '')}'"
+
+
+async def _do_click(page: Page, action: dict) -> str:
+    await page.locator(action["selector"]).click(timeout=ACTION_TIMEOUT)
+    return f"[OK] Clicked '{action['selector']}'"
+
+
+async def _do_press(page: Page, action: dict) -> str:
+    key = action.get("key", "Enter")
+    await page.press(action["selector"], key, timeout=ACTION_TIMEOUT)
+    return f"[OK] Pressed '{key}' on '{action['selector']}'"
+
+
+async def _do_wait(page: Page, action: dict) -> str:
+    if selector := action.get("selector"):
+        await page.wait_for_selector(selector, state="visible", timeout=ACTION_TIMEOUT)
+        return f"[OK] Element visible: '{selector}'"
+    await page.wait_for_timeout(800)
+    return "[OK] Waited 800ms"
+
+
+# Actions that may navigate; the next batch waits for the DOM to be ready instead of sleeping.
+# Locator fill/click already auto-wait for their element, so no fixed pause is needed.
+SETTLE_AFTER = frozenset({"click"})
+
+# First "[" to last "]": the action array inside whatever prose or fences the LLM added
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL)
+
+# action type → (handler, fields the action must carry)
+ACTION_HANDLERS = {
+    "fill":  (_do_fill,  ("selector",)),
+    "click": (_do_click, ("selector",)),
+    "press": (_do_press, ("selector",)),
+    "wait":  (_do_wait,  ()),
+}
+
+
+# A page has one keyboard focus and one mouse, and a click can move focus or navigate, so
+# only waits for a selector are read-only enough to run side by side; everything else runs alone
+def batch_actions(actions: list[dict]) -> list[list[dict]]:
+    """Split a plan into batches: consecutive selector waits sharing a parallel_group run together.
+
+    Any other action ignores parallel_group and gets a batch of its own.
+    """
+    batches: list[list[dict]] = []
+    previous = None
+    for action in actions:
+        grouped = action.get("type") == "wait" and action.get("selector")
+        group = action.get("parallel_group") if grouped else None
+        if group is not None and group == previous:
+            batches[-1].append(action)
+        else:
+            batches.append([action])
+        previous = group
+    return batches
+
+
+async def dispatch_action(page: Page, action: dict) -> str:
+    """Run one planned action and describe the outcome; failures become result lines, not exceptions."""
+    action_type = action.get("type", "")
+    if action_type not in ACTION_HANDLERS:
+        return f"! Unknown action type: '{action_type}'"
+
+    handler, required = ACTION_HANDLERS[action_type]
+    missing = [field for field in required if not action.get(field)]
+    if missing:
+        return f"! {action_type} is missing {', '.join(missing)}"
+
+    try:
+        return await handler(page, action)
+    except PlaywrightTimeout:
+        return f"[TIMEOUT] {action_type} '{action.get('selector', '')}'"
+    except Exception as e:
+        return f"[ERROR] {action_type} '{action.get('selector', '')}': {e}"
+
+
+# ─────────────────────────────────────────────
+# Context budgeting (prefill cost grows with prompt length)
+# ─────────────────────────────────────────────
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate a prompt's token count as words + punctuation marks."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Cut text to about `budget` tokens, ending on a sentence boundary when one is close."""
+    for i, match in enumerate(_TOKEN_RE.finditer(text)):
+        if i == budget:
+            cut = text[:match.start()]
+            end = cut.rfind(". ")
+            return cut[:end + 1] if end > len(cut) // 2 else cut.rstrip()
+    return text
+
+
+# messages.id → estimated tokens; stored rows never change, so each is counted once
+_token_counts: OrderedDict[int, int] = OrderedDict()
+TOKEN_COUNT_CACHE_SIZE = 4096
+
+
+def message_tokens(message: dict) -> int:
+    count = _token_counts.get(message["id"])
+    if count is None:
+        count = _token_counts[message["id"]] = estimate_tokens(message["content"])
+        if len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return count
+
+
+def fit_history(history: list[dict], budget: int) -> list[dict]:
+    """Keep the newest messages whose combined token estimate fits within budget."""
+    used = 0
+    for i in range(len(history) - 1, -1, -1):
+        used += message_tokens(history[i])
+        if used > budget:
+            return history[i + 1:]
+    return history
+
+
+async def summarize_history(session_id: str):
+    """Fold older turns into the session summary once SUMMARY_EVERY_TURNS new turns pile up.
+
+    Runs after the response is sent. The last exchange (2 messages) always stays verbatim.
+    """
+    summary = await get_session_summary(session_id)
+    previous, upto_id = summary if summary else ("", 0)
+    async with db.execute(
+        "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY id",
+        (session_id, upto_id),
+    ) as cursor:
+        rows = await cursor.fetchall()
+    if len(rows) < 2 * SUMMARY_EVERY_TURNS + 2:
+        return
+
+    older = rows[:-2]
+    conversation = "\n".join(f"{row['role'].capitalize()}: {row['content']}" for row in older)
+    prompt = get_prompt(
+        "conversation_summary", previous_summary=previous or "(none)", conversation=conversation
+    )
+    try:
+        content = (await llm(prompt, model=CLASSIFIER_MODEL)).strip()
+    except Exception as e:
+        logger.warning("History summarization failed: %s", e)
+        return
+    if content:
+        await save_session_summary(session_id, content, older[-1]["id"])
+        logger.info("Summarized %s messages for session %s", len(older), session_id)
+
+
+# ─────────────────────────────────────────────
+# Response cache (exact match, plus embedding similarity when EMBED_MODEL is set)
+# ─────────────────────────────────────────────
+# key → (endpoint, response, unit-length query embedding or None), least recently used first
+_response_cache: OrderedDict[str, tuple[str, str, list[float] | None]] = OrderedDict()
+
+
+def response_key(endpoint: str, text: str) -> str:
+    normalized = " ".join(text.lower().split()).rstrip("?!. ")
+    return endpoint + ":" + hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+
+async def embed_query(text: str) -> list[float] | None:
+    """Embed a query and scale it to unit length, so cosine similarity is a dot product."""
+    try:
+        response = await ollama_client.embed(model=EMBED_MODEL, input=text, keep_alive=OLLAMA_KEEP_ALIVE)
+    except Exception as e:
+        logger.warning("Embedding failed, semantic cache skipped: %s", e)
+        return None
+    vector = response["embeddings"][0]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+async def lookup_response(endpoint: str, text: str, semantic: bool = True) -> tuple[str | None, list[float] | None]:
+    """Return (cached_response, query_embedding); the embedding is reused by store_response."""
+    key = response_key(endpoint, text)
+    if key in _response_cache:
+        _response_cache.move_to_end(key)
+        logger.info("Response cache hit (%s)", endpoint)
+        return _response_cache[key][1], None
+    if not (semantic and EMBED_MODEL):
+        return None, None
+
+    embedding = await embed_query(text)
+    if embedding is None:
+        return None, None
+    best_key, best_score = None, SEMANTIC_CACHE_THRESHOLD
+    for cached_key, (cached_endpoint, _, cached_embedding) in _response_cache.items():
+        if cached_endpoint == endpoint and cached_embedding is not None:
+            score = sum(a * b for a, b in zip(embedding, cached_embedding))
+            if score >= best_score:
+                best_key, best_score = cached_key, score
+    if best_key is None:
+        return None, embedding
+    _response_cache.move_to_end(best_key)
+    logger.info("Semantic response cache hit (%s, similarity %.3f)", endpoint, best_score)
+    return _response_cache[best_key][1], embedding
+
+
+def store_response(endpoint: str, text: str, response: str, embedding: list[float] | None = None):
+    key = response_key(endpoint, text)
+    _response_cache[key] = (endpoint, response, embedding)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
+
+# ─────────────────────────────────────────────
+# Local pre-checks (built once, not per request)
+# ─────────────────────────────────────────────
+# Cheap regex / dictionary checks that settle obvious cases without an LLM call.
+GREETINGS = frozenset({
+    "hi", "hello", "hey", "hiya", "howdy", "greetings", "sup", "whats up",
+    "what's up", "good morning", "good afternoon", "good evening", "good day",
+    "morning", "afternoon", "evening", "yo", "helo", "hii", "hiii", "heya",
+})
+_GREETING_RE = re.compile(
+    r"^[\s!.,?]*(?:" + "|".join(re.escape(g) for g in sorted(GREETINGS, key=len, reverse=True)) + r")[\s!.,?]*$",
+    re.IGNORECASE,
+)
+
+GREETING_REPLY = (
+    "Hello! I'm **MediSimple**, your friendly medical information assistant.\n\n"
+    "I can help you understand medical conditions, symptoms, medications, and health "
+    "topics in plain, simple language. Just ask me anything — like *What is diabetes?* "
+    "or *How does the heart work?*\n\n"
+    "What would you like to know about today?"
+)
+
+# Questions about the conversation itself — answered from history, not Wikipedia
+META_PATTERNS = (
+    "pain point", "summary", "summarize", "our conversation",
+    "what did we", "what have we", "what was discussed", "recap", "what did i ask",
+    "what did you say", "give me a", "list the", "bullet point", "in short",
+    "in brief", "tldr", "tl;dr", "key points", "main points", "highlights",
+)
+# One alternation scanned in a single pass; same substring semantics as the old any() loop
+_META_RE = re.compile("|".join(re.escape(p) for p in META_PATTERNS), re.IGNORECASE)
+
+# Replies to a "Did you mean:" list that pick a suggestion unambiguously
+CONFIRMATION_RE = re.compile(
+    r"^\s*(?:y|yes|yeah|yep|yup|sure|ok|okay|confirm|correct|right|exactly)"
+    r"(?:[\s,!.]+(?:that one|this one|please|thanks|thank you))?[\s!.]*$",
+    re.IGNORECASE,
+)
+_CHOICE_RE = re.compile(
+    r"^\s*(?:the\s+|number\s+|option\s+|#)?(\d|first|second|third|last)(?:\s+one)?[\s!.]*$",
+    re.IGNORECASE,
+)
+_ORDINALS = {"first": 0, "second": 1, "third": 2, "last": -1}
+_SUGGESTED_TERM_RE = re.compile(r"^\s*\d+\.\s*\*\*(.+?)\*\*", re.MULTILINE)
+
+
+def local_confirmation(query: str, suggestion: str) -> str | None:
+    """Return the suggested term a reply clearly picks ("yes", "2", "the first one", the term itself)."""
+    terms = _SUGGESTED_TERM_RE.findall(suggestion)
+    if not terms:
+        return None
+    text = query.strip().lower()
+    for term in terms:
+        if text == term.lower():
+            return term
+    if match := _CHOICE_RE.match(query):
+        choice = match.group(1).lower()
+        if choice.isdigit():   # 1-based; "0" or out-of-range numbers pick nothing
+            return terms[int(choice) - 1] if 1 <= int(choice) <= len(terms) else None
+        index = _ORDINALS[choice]   # only "last" is negative
+        return terms[index] if index < len(terms) else None
+    if CONFIRMATION_RE.match(query):
+        return terms[0]
+    return None
+
+
+# Correctly spelled terms never need the typo LLM; near-misses of them probably do.
+MEDICAL_TERMS = frozenset({
+    "acne", "addiction", "adhd", "aids", "cpr", "ecg", "gerd", "ibs", "std", "uti", "allergy", "allergies", "alzheimer", "alzheimer's",
+    "anemia", "aneurysm", "angina", "anorexia", "antibiotic", "antibiotics", "anxiety",
+    "appendicitis", "arrhythmia", "arthritis", "aspirin", "asthma", "autism", "bacteria",
+    "blood", "bone", "bones", "brain", "bronchitis", "bulimia", "cancer", "cardiac",
+    "cataract", "cataracts", "celiac", "chemotherapy", "chickenpox", "cholesterol",
+    "cirrhosis", "colitis", "concussion", "constipation", "copd", "coronavirus", "covid",
+    "crohn's", "dementia", "depression", "dermatitis", "diabetes", "diarrhea", "disease",
+    "eczema", "embolism", "emphysema", "endometriosis", "epilepsy", "fever", "fibromyalgia",
+    "flu", "fracture", "gallstones", "gastritis", "glaucoma", "gout", "headache", "heart",
+    "hemorrhoids", "hepatitis", "hernia", "herpes", "hiv", "hormone", "hormones",
+    "hypertension", "hypoglycemia", "hypotension", "hypothyroidism", "hyperthyroidism",
+    "ibuprofen", "immune", "infection", "inflammation", "influenza", "insomnia", "insulin",
+    "kidney", "kidneys", "leukemia", "liver", "lung", "lungs", "lupus", "lymphoma",
+    "malaria", "measles", "melanoma", "menopause", "metformin", "migraine", "migraines",
+    "mri", "multiple", "ocd", "ptsd", "sclerosis", "obesity", "osteoporosis", "pancreas", "pancreatitis",
+    "paracetamol", "parkinson", "parkinson's", "parkinsons", "penicillin", "pneumonia",
+    "psoriasis", "rash", "schizophrenia", "scoliosis", "seizure", "seizures", "sepsis",
+    "shingles", "sinusitis", "skin", "stomach", "stroke", "symptom", "symptoms",
+    "tachycardia", "tetanus", "thyroid", "tonsillitis", "tuberculosis", "tumor", "ulcer",
+    "vaccine", "vaccines", "vertigo", "virus", "vitamin", "vitamins",
+})
+COMMON_WORDS = frozenset({
+    "a", "about", "after", "age", "all", "also", "an", "and", "any", "are", "arm", "as", "at",
+    "back", "bad", "be", "before", "between", "body", "but", "by", "can", "cause", "causes",
+    "chest", "child", "children", "cold", "cough", "could", "cure", "define", "did", "diet",
+    "difference", "do", "does", "ear", "effects", "example", "explain", "eye", "eyes", "feel",
+    "food", "foot", "for", "from", "get", "give", "go", "good", "hand", "has", "have", "head",
+    "help", "high", "how", "hurt", "i", "i'm", "if", "in", "is", "it", "its", "kids", "know",
+    "leg", "level", "like", "list", "long", "low", "make", "many", "me", "mean", "more", "most",
+    "much", "my", "neck", "need", "new", "no", "normal", "nose", "not", "of", "ok", "okay",
+    "old", "on", "one", "or", "our", "out", "pain", "points", "rate", "risk", "risks", "see",
+    "short", "should", "side", "sick", "signs", "simple", "sleep", "so", "some", "sore",
+    "stress", "summary", "take", "tell", "terms", "test", "tests", "than", "thank", "thanks",
+    "that", "the", "them", "then", "they", "this", "throat", "to", "too", "treat", "treatment",
+    "two", "type", "up", "us", "use", "very", "want", "was", "we", "what", "what's", "when",
+    "who", "why", "will", "with", "work", "would", "yes", "you", "your",
+})
+_WORD_RE = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+
+def needs_typo_check(query: str) -> bool:
+    """Return True only when the query might be a misspelled medical term worth asking the LLM.
+
+    Mirrors the typo prompt's own rules: 5+ word sentences and fully recognised
+    words are always clear; unknown short words (possible abbreviations) and
+    near-misses of known terms are left to the LLM.
+    """
+    words = _WORD_RE.findall(query.lower())
+    if not words or len(words) >= 5:
+        return False
+    for word in words:
+        if word in MEDICAL_TERMS or word in COMMON_WORDS:
+            continue
+        if len(word) <= 4 or difflib.get_close_matches(word, MEDICAL_TERMS, n=1, cutoff=0.75):
+            return True
+    return False
+
+
+# ─────────────────────────────────────────────
+# Query classification (confirmation / follow-up / typo)
+# ─────────────────────────────────────────────
+# Classification is a deterministic function of its prompt, so results are kept in
+# a bounded LRU keyed on a hash of the prompt. Each entry remembers the session that
+# stored it so clearing a session's history also drops its cached classifications.
+_classify_cache: OrderedDict[str, tuple[str, tuple]] = OrderedDict()
+_classify_cache_sessions: dict[str, set[str]] = {}
+
+
+def _unlink_classification(session_id: str, key: str):
+    """Drop key from a session's index, and the session itself once it owns nothing."""
+    keys = _classify_cache_sessions.get(session_id)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del _classify_cache_sessions[session_id]
+
+
+def cache_classification(session_id: str, key: str, result: tuple):
+    """Store a classification result, evicting the least recently used entry when full."""
+    if key in _classify_cache:
+        # Identical prompts hash alike across sessions; the latest writer owns the entry
+        _unlink_classification(_classify_cache[key][0], key)
+    _classify_cache[key] = (session_id, result)
+    _classify_cache.move_to_end(key)
+    _classify_cache_sessions.setdefault(session_id, set()).add(key)
+    while len(_classify_cache) > CLASSIFY_CACHE_SIZE:
+        old_key, (old_session, _) = _classify_cache.popitem(last=False)
+        _unlink_classification(old_session, old_key)
+
+
+def clear_classification_cache(session_id: str):
+    """Forget every cached classification stored by a session."""
+    for key in _classify_cache_sessions.pop(session_id, set()):
+        _classify_cache.pop(key, None)
+
+
+def last_suggestion(history: list[dict]) -> str | None:
+    """Return the last assistant reply if it offered 'Did you mean:' suggestions."""
+    # Turns are saved as user/assistant pairs, so the last reply is one of the final two messages
+    for i in (-1, -2):
+        if len(history) >= -i and history[i]["role"] == "assistant":
+            content = history[i]["content"]
+            return content if "Did you mean:" in content else None
+    return None
+
+
+def format_suggestions(suggestions: list[dict]) -> str:
+    """Render typo suggestions in the 'Did you mean:' format the confirmation step expects."""
+    lines = ["Did you mean:"]
+    for i, s in enumerate(suggestions, 1):
+        lines.append(f"{i}. **{s['term']}** — {s.get('description', '')}")
+    return "\n".join(lines)
+
+
+async def classify_query(
+    query: str, history: list[dict], session_id: str, check_typo: bool = True
+) -> tuple[str | None, bool, str | None]:
+    """Classify a chat query with a single JSON-mode LLM call (cached per prompt).
+
+    Returns (confirmed_term, is_followup, typo_clarification). Falls back to the
+    separate per-task prompts when the model does not return usable JSON.
+    """
+    suggestion = last_suggestion(history)
+    if not history and not check_typo:
+        return None, False, None
+    if suggestion and (term := local_confirmation(query, suggestion)):
+        return term, False, None
+
+    history_text = "\n".join(f"{m['role']}: {m['content']}" for m in history[-4:])
+    prompt = get_prompt(
+        "combined_classification",
+        suggestion=suggestion or "(none)",
+        history=history_text or "(none)",
+        query=query,
+    )
+    key = hashlib.blake2b(f"{check_typo}:{prompt}".encode(), digest_size=16).hexdigest()
+    if key in _classify_cache:
+        _classify_cache.move_to_end(key)
+        logger.info("Classification cache hit")
+        return _classify_cache[key][1]
+
+    result = await run_classification(prompt, query, history, suggestion, check_typo)
+    cache_classification(session_id, key, result)
+    return result
+
+
+async def run_classification(
+    prompt: str, query: str, history: list[dict], suggestion: str | None, check_typo: bool
+) -> tuple[str | None, bool, str | None]:
+    """Run the combined classification prompt, falling back to the separate ones."""
+    try:
+        result = orjson.loads(await llm(prompt, json_mode=True, model=CLASSIFIER_MODEL))
+        confirmed = result.get("confirmed")
+        typo = result.get("typo")
+        clarification = format_suggestions(typo) if check_typo and typo else None
+    except (orjson.JSONDecodeError, AttributeError, TypeError, KeyError) as e:
+        logger.warning("Combined classification unusable (%s) — falling back to separate prompts", e)
+        return await classify_query_separately(query, history, suggestion, check_typo)
+
+    # Same precedence as the separate prompts: confirmation > follow-up > typo
+    if suggestion and isinstance(confirmed, str) and confirmed.strip():
+        return confirmed.strip(), False, None
+    if history and result.get("is_followup") is True:
+        return None, True, None
+    return None, False, clarification
+
+
+async def classify_query_separately(
+    query: str, history: list[dict], suggestion: str | None, check_typo: bool
+) -> tuple[str | None, bool, str | None]:
+    """Fallback: run the individual classification prompts concurrently."""
+    confirm_task = followup_task = typo_task = None
+    if suggestion:
+        confirm_prompt = get_prompt("confirmation_detection", suggestion=suggestion, query=query)
+        confirm_task = asyncio.create_task(llm(confirm_prompt, model=CLASSIFIER_MODEL))
+    if history:
+        history_text = "\n".join(f"{m['role']}: {m['content']}" for m in history[-4:])
+        followup_prompt = get_prompt("followup_detection", history=history_text, query=query)
+        followup_task = asyncio.create_task(llm(followup_prompt, model=CLASSIFIER_MODEL))
+    if check_typo:
+        typo_prompt = get_prompt("typo_detection", query=query)
+        typo_task = asyncio.create_task(llm(typo_prompt, model=CLASSIFIER_MODEL))
+    pending = [task for task in (confirm_task, followup_task, typo_task) if task]
+
+    try:
+        if confirm_task:
+            result = (await confirm_task).strip()
+            if result.startswith("CONFIRMED:"):
+                return result.replace("CONFIRMED:", "").strip(), False, None
+        if followup_task and (await followup_task).strip() == "FOLLOW_UP":
+            return None, True, None
+        if typo_task:
+            typo_result = (await typo_task).strip()
+            if typo_result.startswith("TYPO:"):
+                return None, False, typo_result.replace("TYPO:", "").strip()
+        return None, False, None
+    finally:
+        # Drop speculative calls whose result is no longer needed (no-op for finished tasks)
+        for task in pending:
+            task.cancel()
+
+
 # ─────────────────────────────────────────────
 # Routes
 # ─────────────────────────────────────────────
@@ -245,19 +975,19 @@ async def connect_browser(request: dict):
         return {"error": "URL is required"}
 
     try:
-        logger.info(f"Navigating to {url}")
-        page = await new_page()
+        logger.info("Navigating to %s", url)
+        page = await new_page(request.get("session_id", "default"))
         await page.goto(url, wait_until="domcontentloaded", timeout=BROWSER_TIMEOUT)
 
-        dom = await page.evaluate(DOM_SCRIPT)
-        logger.info(f"Extracted {len(dom)} visible elements")
+        dom = orjson.loads(await page.evaluate(DOM_SCRIPT, MAX_DOM_ELEMENTS))
+        logger.info("Extracted %s visible elements", len(dom))
         return {"status": "connected", "dom": dom}
 
     except PlaywrightTimeout:
-        logger.error(f"Timeout loading {url}")
+        logger.error("Timeout loading %s", url)
         return {"error": "Page load timed out. Please check the URL and try again."}
     except Exception as e:
-        logger.error(f"Connection error: {e}")
+        logger.error("Connection error: %s", e)
         return {"error": str(e)}
 
 
@@ -265,95 +995,81 @@ async def connect_browser(request: dict):
 async def plan_task(request: TaskRequest):
     """Use LLM to plan browser actions from DOM + instruction."""
     try:
-        logger.info(f"Planning: {request.instruction}")
+        logger.info("Planning: %s", request.instruction)
         prompt = get_prompt("action_planning", dom=request.dom, instruction=request.instruction)
-        plan = llm(prompt)
-        logger.info(f"Plan: {plan[:120]}...")
+        plan = await llm(prompt)
+        logger.info("Plan: %s...", plan[:120])
         return {"plan": plan}
     except Exception as e:
-        logger.error(f"Planning error: {e}")
+        logger.error("Planning error: %s", e)
         return {"error": str(e)}
 
 
 @app.post("/execute")
 async def execute_actions(request: ExecuteRequest):
-    """Execute a JSON action plan in the browser."""
-    if not current_page:
+    """Execute a JSON action plan in the session's browser page."""
+    page = get_session_page(request.session_id)
+    if not page:
         return {"error": "No browser connected. Call /connect first."}
 
     try:
         # Robustly extract JSON array from LLM output
-        raw = request.actions
-        start = raw.find("[")
-        end = raw.rfind("]") + 1
-        if start < 0 or end <= start:
+        match = _JSON_ARRAY_RE.search(request.actions)
+        if not match:
             return {"status": "error", "message": "No JSON array found in actions"}
 
-        actions: list[dict] = json.loads(raw[start:end])
+        actions: list[dict] = orjson.loads(match.group())
         results = []
+        settle = False
 
-        for i, action in enumerate(actions):
-            action_type = action.get("type", "")
-            selector = action.get("selector", "")
-            value = action.get("value", "")
-            key = action.get("key", "Enter")
-
-            logger.info(f"Action {i+1}/{len(actions)}: {action_type} | {selector}")
+        for i, batch in enumerate(batch_actions(actions)):
+            for action in batch:
+                logger.info("Batch %s: %s | %s", i + 1, action.get('type', ''), action.get('selector', ''))
+            if settle:
+                await page.wait_for_load_state("domcontentloaded", timeout=ACTION_TIMEOUT)
+            results += await asyncio.gather(*(dispatch_action(page, a) for a in batch))
+            settle = any(a.get("type") in SETTLE_AFTER for a in batch)
 
-            try:
-                if action_type == "fill":
-                    await current_page.fill(selector, value, timeout=ACTION_TIMEOUT)
-                    await current_page.wait_for_timeout(300)
-                    results.append(f"[OK] Filled '{selector}' with '{value}'")
-
-                elif action_type == "click":
-                    await current_page.click(selector, timeout=ACTION_TIMEOUT)
-                    await current_page.wait_for_timeout(300)
-                    results.append(f"[OK] Clicked '{selector}'")
-
-                elif action_type == "press":
-                    await current_page.press(selector, key, timeout=ACTION_TIMEOUT)
-                    results.append(f"[OK] Pressed '{key}' on '{selector}'")
-
-                elif action_type == "wait":
-                    if selector:
-                        await current_page.wait_for_selector(selector, state="visible", timeout=ACTION_TIMEOUT)
-                        results.append(f"[OK] Element visible: '{selector}'")
-                    else:
-                        await current_page.wait_for_timeout(800)
-                        results.append("[OK] Waited 800ms")
-
-                else:
-                    results.append(f"! Unknown action type: '{action_type}'")
-
-            except PlaywrightTimeout:
-                results.append(f"[TIMEOUT] {action_type} '{selector}'")
-            except Exception as e:
-                results.append(f"[ERROR] {action_type} '{selector}': {e}")
-
-        logger.info(f"Execution complete: {len(results)} steps")
+        logger.info("Execution complete: %s steps", len(results))
         return {"status": "success", "results": results}
 
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parse error: {e}")
+    except orjson.JSONDecodeError as e:
+        logger.error("JSON parse error: %s", e)
         return {"status": "error", "message": f"Invalid action JSON: {e}"}
     except Exception as e:
-        logger.error(f"Execution error: {e}")
+        logger.error("Execution error: %s", e)
         return {"status": "error", "message": str(e)}
 
 
+async def stream_simplified(content: str, prompt: str) -> AsyncIterator[str]:
+    """Yield the simplified article as it streams, then cache the full text."""
+    chunks = []
+    try:
+        async for chunk in llm_stream([{"role": "user", "content": prompt}]):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        logger.error("Simplification stream error: %s", e)
+        yield "Something went wrong while simplifying this page. Please try again."
+        return
+    store_response("simplify", content, "".join(chunks))
+
+
 @app.post("/simplify")
 async def simplify_article(request: dict):
-    """Extract and simplify the current page's article content."""
-    if not current_page:
+    """Extract and simplify the article content of the session's connected page."""
+    page = get_session_page(request.get("session_id", "default"))
+    if not page:
         return {"error": "No browser connected."}
 
     try:
-        content = await current_page.evaluate("""() => {
+        content = await page.evaluate("""() => {
             const selectors = ['article', '[role=\"main\"]', '.article-content', '.content', 'main', '#content'];
             for (const sel of selectors) {
                 const el = document.querySelector(sel);
-                if (el && el.innerText.length > 200) return el.innerText;
+                if (!el) continue;
+                const text = el.innerText;   // read once: every innerText access forces layout
+                if (text.length > 200) return text;
             }
             return document.body.innerText;
         }""")
@@ -362,19 +1078,53 @@ async def simplify_article(request: dict):
             return {"error": "Could not extract meaningful article content from this page."}
 
         content = content[:4000]   # increased cap for richer context
-        logger.info(f"Extracted {len(content)} chars for simplification")
+        logger.info("Extracted %s chars for simplification", len(content))
+
+        # Same article text → same simplification; embedding a whole article isn't worth it
+        cached, _ = await lookup_response("simplify", content, semantic=False)
+        if cached:
+            if request.get("stream"):
+                return StreamingResponse(iter([cached]), media_type="text/plain; charset=utf-8")
+            return {"simplified": cached}
 
         prompt = get_prompt("article_simplification", content=content)
-        simplified = llm(prompt)
+        if request.get("stream"):
+            return StreamingResponse(stream_simplified(content, prompt), media_type="text/plain; charset=utf-8")
+
+        simplified = await llm(prompt)
+        store_response("simplify", content, simplified)
         return {"simplified": simplified}
 
     except Exception as e:
-        logger.error(f"Simplification error: {e}")
+        logger.error("Simplification error: %s", e)
         return {"error": str(e)}
 
 
+async def stream_reply(
+    session_id: str, rows: list[tuple[str, str]], messages: list,
+    cache: tuple[str, list[float] | None] | None = None,
+) -> AsyncIterator[str]:
+    """Yield the final answer as it streams, then save the turn.
+
+    `cache` is (query, embedding) for answers that go into the response cache.
+    """
+    chunks = []
+    try:
+        async for chunk in llm_stream(messages):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        logger.error("Chat stream error: %s", e)
+        yield "Something went wrong on my end. Please try again."
+        return
+    logger.info("Response streamed")
+    if cache:
+        store_response("chat", cache[0], "".join(chunks), cache[1])
+    await save_messages(session_id, rows + [("assistant", "".join(chunks))])
+
+
 @app.post("/chat")
-async def chat(request: dict):
+async def chat(request: dict, background_tasks: BackgroundTasks):
     """Main chat endpoint — detects typos, searches Wikipedia, returns simplified answers."""
     query: str = request.get("query", "").strip()
     session_id: str = request.get("session_id", "default")
@@ -386,120 +1136,104 @@ async def chat(request: dict):
     if len(query) > MAX_QUERY_LENGTH:
         return {"response": "Your question is a bit long. Could you shorten it so I can help better?"}
 
+    wiki_task: asyncio.Task | None = None
     try:
-        history = await get_session_history(session_id)
+        # Turns already folded into the summary are replaced by it; every newer one is loaded
+        # (summarize_history leaves at most 2*SUMMARY_EVERY_TURNS+1) and fit_history trims to budget
+        summary, summarized_upto = await get_session_summary(session_id) or ("", 0)
+        history = fit_history(
+            await get_session_history(
+                session_id, limit=2 * SUMMARY_EVERY_TURNS + 1, after_id=summarized_upto
+            ),
+            HISTORY_TOKEN_BUDGET,
+        )
+        background_tasks.add_task(summarize_history, session_id)   # runs after the response
+
+        # ── Step 0: Greeting check is local, so decide it before spending an LLM call ──
+        is_greeting = _GREETING_RE.match(query) is not None
+
+        # Start the Wikipedia lookup now so it overlaps the classifier call; dropped if unused.
+        # A locally confirmed suggestion is looked up as its term; greetings and meta queries
+        # answered from history never reach Wikipedia, so they start nothing
+        suggestion = last_suggestion(history)
+        wiki_query = suggestion and local_confirmation(query, suggestion)
+        if not wiki_query and not is_greeting and not ((history or summary) and _META_RE.search(query)):
+            wiki_query = query
+        if wiki_query:
+            wiki_task = asyncio.create_task(fetch_wikipedia(wiki_query))
+            wiki_task.add_done_callback(lambda t: t.cancelled() or t.exception())  # never "unretrieved"
+
+        # ── Steps 1, 2 & 4: Confirmation, follow-up and typo detection in one LLM call ──
+        # Follow-up messages like "explain it to me like I'm 5" can false-positive as typos,
+        # so a follow-up or confirmed term always suppresses the typo result.
+        # A greeting only matters to the classifier if it might be confirming a suggestion
+        if is_greeting and not suggestion:
+            confirmed_term, is_followup, clarification = None, False, None
+        else:
+            confirmed_term, is_followup, clarification = await classify_query(
+                query, history, session_id, check_typo=not is_greeting and needs_typo_check(query)
+            )
+        logger.info("Follow-up: %s", is_followup)
 
-        # ── Step 1: Confirmation check (if last reply contained a suggestion) ──
+        # ── Step 1: Confirmation (if last reply contained a suggestion) ──
         just_confirmed = False  # flag to force Wikipedia search, bypassing follow-up detection
-        if history:
-            last_assistant = next((m for m in reversed(history) if m["role"] == "assistant"), None)
-            if last_assistant and "Did you mean:" in last_assistant["content"]:
-                confirm_prompt = get_prompt(
-                    "confirmation_detection",
-                    suggestion=last_assistant["content"],
-                    query=query,
-                )
-                result = llm(confirm_prompt).strip()
-                if result.startswith("CONFIRMED:"):
-                    confirmed_term = result.replace("CONFIRMED:", "").strip()
-                    logger.info(f"Confirmed term: {confirmed_term}")
-                    await save_message(session_id, "user", query)
-                    query = confirmed_term  # proceed with the corrected term
-                    just_confirmed = True  # must fetch Wikipedia fresh, not treat as follow-up
-
-        # ── Step 2: Follow-up detection (runs before typo check to protect follow-up messages) ──
-        is_followup = False
-        if history and not just_confirmed:  # confirmed terms always need a fresh Wikipedia fetch
-            history_text = "\n".join(f"{m['role']}: {m['content']}" for m in history[-4:])
-            followup_prompt = get_prompt("followup_detection", history=history_text, query=query)
-            followup_result = llm(followup_prompt).strip()
-            is_followup = followup_result == "FOLLOW_UP"
-            logger.info(f"Follow-up: {is_followup}")
+        pending_rows: list[tuple[str, str]] = []  # persisted together with the final reply
+        if confirmed_term:
+            logger.info("Confirmed term: %s", confirmed_term)
+            pending_rows.append(("user", query))
+            query = confirmed_term  # proceed with the corrected term
+            just_confirmed = True  # must fetch Wikipedia fresh, not treat as follow-up
 
         # ── Step 3: Greeting detection — respond directly, skip Wikipedia entirely ──
-        GREETINGS = {
-            "hi", "hello", "hey", "hiya", "howdy", "greetings", "sup", "whats up",
-            "what's up", "good morning", "good afternoon", "good evening", "good day",
-            "morning", "afternoon", "evening", "yo", "helo", "hii", "hiii", "heya",
-        }
-        if query.lower().strip("! .,?") in GREETINGS:
-            greeting_reply = (
-                "Hello! I'm **MediSimple**, your friendly medical information assistant.\n\n"
-                "I can help you understand medical conditions, symptoms, medications, and health "
-                "topics in plain, simple language. Just ask me anything — like *What is diabetes?* "
-                "or *How does the heart work?*\n\n"
-                "What would you like to know about today?"
-            )
-            await save_message(session_id, "user", query)
-            await save_message(session_id, "assistant", greeting_reply)
-            return {"response": greeting_reply}
+        if is_greeting and not just_confirmed:
+            await save_messages(session_id, [("user", query), ("assistant", GREETING_REPLY)])
+            return {"response": GREETING_REPLY}
 
-        # ── Step 4: Typo detection (skip for follow-ups and confirmed terms) ──
-        # Follow-up messages like "explain it to me like I'm 5" can false-positive as typos.
-        if not is_followup and not just_confirmed:
-            typo_prompt = get_prompt("typo_detection", query=query)
-            typo_result = llm(typo_prompt).strip()
-
-            if typo_result.startswith("TYPO:"):
-                clarification = typo_result.replace("TYPO:", "").strip()
-                logger.info(f"Typo flagged: {clarification}")
-                await save_message(session_id, "user", query)
-                await save_message(session_id, "assistant", clarification)
-                return {"response": clarification}
+        # ── Step 4: Typo detection ──
+        if clarification:
+            logger.info("Typo flagged: %s", clarification)
+            await save_messages(session_id, [("user", query), ("assistant", clarification)])
+            return {"response": clarification}
 
         # ── Step 4.5: Meta-query detection — skip Wikipedia for questions about the conversation ──
-        META_PATTERNS = [
-            "pain point", "pain points", "summary", "summarize", "our conversation",
-            "what did we", "what have we", "what was discussed", "recap", "what did i ask",
-            "what did you say", "give me a", "list the", "bullet point", "in short",
-            "in brief", "tldr", "tl;dr", "key points", "main points", "highlights",
-        ]
-        query_lower = query.lower()
-        is_meta = any(pattern in query_lower for pattern in META_PATTERNS)
-        if is_meta and history:
+        is_meta = _META_RE.search(query) is not None
+        if is_meta and (history or summary):
             logger.info("Meta/conversational query detected — skipping Wikipedia")
             is_followup = True  # force the follow-up path so history is used as context
 
         # ── Step 5: Fetch Wikipedia for new topics ──
+        embedding = None
         if not is_followup:
-            page = await new_page()
+            # New-topic answers come from the question and its article, so repeats can be reused
+            cached, embedding = await lookup_response("chat", query)
+            if cached:
+                await save_messages(session_id, pending_rows + [("user", query), ("assistant", cached)])
+                if request.get("stream"):
+                    return StreamingResponse(iter([cached]), media_type="text/plain; charset=utf-8")
+                return {"response": cached}
+
             try:
-                await page.goto(WIKIPEDIA_BASE, wait_until="domcontentloaded", timeout=BROWSER_TIMEOUT)
-                await page.fill('input[name="search"]', query)
-                await page.wait_for_timeout(400)
-                await page.press('input[name="search"]', "Enter")
-                await page.wait_for_load_state("domcontentloaded", timeout=PAGE_TIMEOUT)
-                logger.info(f"Wikipedia searched for: {query}")
-
-                content = await page.evaluate("""() => {
-                    const article = document.querySelector('#mw-content-text');
-                    if (!article) return document.body.innerText;
-                    const paras = article.querySelectorAll('p');
-                    let text = '';
-                    for (let i = 0; i < Math.min(8, paras.length); i++) {
-                        text += paras[i].innerText + '\\n\\n';
-                    }
-                    return text;
-                }""")
-
-            except PlaywrightTimeout:
-                logger.error("Wikipedia load timeout")
+                content = await (wiki_task if wiki_task and wiki_query == query else fetch_wikipedia(query))
+            except httpx.HTTPError as e:
+                logger.error("Wikipedia request failed: %s", e)
                 return {"response": "I had trouble reaching Wikipedia. Please try again in a moment."}
 
             if not content or len(content) < 100:
                 return {"response": "I couldn't find reliable information on that topic. Could you rephrase your question?"}
 
-            context = f"Wikipedia article:\n{content[:2500]}\n\n"
+            context = f"Wikipedia article:\n{truncate_to_tokens(content, WIKI_CONTEXT_TOKENS)}\n\n"
 
         else:
             # Build context from recent conversation
+            # The summary, if any, is already the leading system message
             context = "Previous conversation:\n"
             for msg in history[-4:]:
                 context += f"{msg['role'].capitalize()}: {msg['content']}\n"
             context += "\n"
 
         # ── Step 6: Build LLM message list and generate response ──
-        messages = [
+        messages = [{"role": "system", "content": f"Summary of the earlier conversation: {summary}"}] if summary else []
+        messages += [
             {"role": ("user" if m["role"] == "user" else "assistant"), "content": m["content"]}
             for m in history[-6:]
         ]
@@ -508,18 +1242,37 @@ async def chat(request: dict):
             "content": get_prompt("simplification", context=context, query=query),
         })
 
-        response_text = llm("", messages=messages)
+        # Only answers written without this session's history or summary are safe to hand to
+        # other sessions; the cache key is the query alone
+        cacheable = not is_followup and not history and not summary
+
+        if request.get("stream"):
+            # Send tokens as they decode; the turn is persisted once the stream completes
+            return StreamingResponse(
+                stream_reply(
+                    session_id, pending_rows + [("user", query)], messages,
+                    cache=(query, embedding) if cacheable else None,
+                ),
+                media_type="text/plain; charset=utf-8",
+            )
+
+        response_text = await llm("", messages=messages)
         logger.info("Response generated")
+        if cacheable:
+            store_response("chat", query, response_text, embedding)
 
         # ── Step 7: Persist ──
-        await save_message(session_id, "user", query)
-        await save_message(session_id, "assistant", response_text)
+        await save_messages(session_id, pending_rows + [("user", query), ("assistant", response_text)])
 
         return {"response": response_text}
 
     except Exception as e:
-        logger.error(f"Chat error: {e}", exc_info=True)
+        logger.error("Chat error: %s", e)
+        logger.debug("Chat error traceback", exc_info=True)
         return {"response": "Something went wrong on my end. Please try again."}
+    finally:
+        if wiki_task:
+            wiki_task.cancel()   # no-op once awaited; stops a lookup no branch ended up using
 
 
 @app.get("/history/{session_id}")
@@ -528,19 +1281,18 @@ async def get_history(session_id: str):
         messages = await get_session_history(session_id, limit=100)
         return {"messages": messages}
     except Exception as e:
-        logger.error(f"History fetch error: {e}")
+        logger.error("History fetch error: %s", e)
         return {"messages": []}
 
 
 @app.delete("/history/{session_id}")
 async def clear_history(session_id: str):
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-            await db.commit()
+        await delete_session_history(session_id)
+        clear_classification_cache(session_id)
         return {"status": "cleared"}
     except Exception as e:
-        logger.error(f"Clear history error: {e}")
+        logger.error("Clear history error: %s", e)
         return {"error": str(e)}
 
 
@@ -548,6 +1300,8 @@ async def clear_history(session_id: str):
 async def health():
     return {
         "status": "ok",
-        "browser_connected": current_page is not None,
+        "browser_connected": bool(session_pages),
+        "browser_sessions": len(session_pages),
         "model": MODEL,
+        "classifier_model": CLASSIFIER_MODEL,
     }
@@ -1,12 +1,13 @@
 from mcp.server.fastmcp import FastMCP
-from playwright.async_api import async_playwright, Browser, Page
-import json
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+import orjson
 from pathlib import Path
 
 mcp = FastMCP("dom-handler")
 
 # State
 browser: Browser | None = None
+context: BrowserContext | None = None
 page: Page | None = None
 playwright_instance = None
 
@@ -14,34 +15,49 @@ playwright_instance = None
 TASKS_FILE = Path("tasks.json")
 
 
+# (mtime, tasks) — reparsed only when the file changes on disk
+_tasks_cache: tuple[float, list] | None = None
+
+
 def load_tasks():
-    if TASKS_FILE.exists():
-        return json.loads(TASKS_FILE.read_text())
-    return []
+    global _tasks_cache
+    try:
+        mtime = TASKS_FILE.stat().st_mtime
+    except FileNotFoundError:
+        return []
+    if _tasks_cache is None or _tasks_cache[0] != mtime:
+        _tasks_cache = (mtime, orjson.loads(TASKS_FILE.read_bytes()))
+    # A copy, so a caller's edits only reach the cache through a successful save_tasks()
+    return list(_tasks_cache[1])
 
 
 def save_tasks(tasks):
-    TASKS_FILE.write_text(json.dumps(tasks, indent=2))
+    global _tasks_cache
+    TASKS_FILE.write_bytes(orjson.dumps(tasks, option=orjson.OPT_INDENT_2))
+    _tasks_cache = (TASKS_FILE.stat().st_mtime, list(tasks))
 
 
 @mcp.resource("tasks://list")
 def get_tasks() -> str:
     """Get all saved tasks"""
-    return json.dumps(load_tasks(), indent=2)
+    return orjson.dumps(load_tasks(), option=orjson.OPT_INDENT_2).decode()
 
 
 @mcp.tool()
 async def connect_browser(url: str) -> str:
     """Connect to a website via CDP"""
-    global browser, page, playwright_instance
+    global browser, context, page, playwright_instance
     
     if not playwright_instance:
         playwright_instance = await async_playwright().start()
         browser = await playwright_instance.chromium.launch(headless=False)
+        context = await browser.new_context()
     
-    page = await browser.new_page()
-    await page.goto(url)
-    await page.wait_for_load_state('networkidle')
+    # Reuse one tab across connects — navigating it is far cheaper than a new page each time
+    if not page or page.is_closed():
+        page = await context.new_page()
+    # Same as api_server /connect: the DOM is enough, later actions auto-wait for their elements
+    await page.goto(url, wait_until='domcontentloaded')
     
     return f"Connected to {url}"
 
@@ -50,30 +66,28 @@ async def connect_browser(url: str) -> str:
 async def get_dom() -> str:
     """Get the current page DOM structure"""
     if not page:
-        return json.dumps({"error": "No browser connected"})
+        return orjson.dumps({"error": "No browser connected"}).decode()
     
     dom = await page.evaluate("""() => {
+        const nodes = document.querySelectorAll('a, button, input, textarea, select, li');
         const elements = [];
-        document.querySelectorAll('a, button, input, textarea, select, li').forEach((el, idx) => {
-            const rect = el.getBoundingClientRect();
-            elements.push({
-                index: idx,
-                tag: el.tagName,
-                text: el.innerText?.slice(0, 50) || el.value || '',
-                type: el.type || '',
-                id: el.id || '',
-                name: el.name || '',
-                class: el.className || '',
-                placeholder: el.placeholder || '',
-                href: el.href || '',
-                ariaLabel: el.ariaLabel || '',
-                visible: rect.width > 0 && rect.height > 0
-            });
-        });
-        return elements.filter(el => el.visible);
+        for (let idx = 0; idx < nodes.length; idx++) {
+            const el = nodes[idx];
+            // Hidden elements are dropped here so they never cross CDP
+            if (el.offsetWidth === 0 || el.offsetHeight === 0) continue;
+            const item = { index: idx, tag: el.tagName };
+            const text = (el.textContent || '').slice(0, 120).replace(/\\s+/g, ' ').trim().slice(0, 50) || el.value;
+            if (text) item.text = text;
+            for (const key of ['type', 'id', 'name', 'placeholder', 'href', 'ariaLabel']) {
+                if (el[key]) item[key] = el[key];
+            }
+            if (typeof el.className === 'string' && el.className) item.class = el.className;
+            elements.push(item);
+        }
+        return elements;
     }""")
     
-    return json.dumps(dom)
+    return orjson.dumps(dom).decode()
 
 
 @mcp.tool()
@@ -93,7 +107,6 @@ async def fill_input(selector: str, value: str) -> str:
         return "No browser connected"
     
     await page.fill(selector, value)
-    await page.wait_for_timeout(500)
     return f"Filled {selector} with {value}"
 
 
@@ -101,7 +114,7 @@ async def fill_input(selector: str, value: str) -> str:
 async def analyze_page() -> str:
     """Analyze if page is a search results page and extract relevant links"""
     if not page:
-        return json.dumps({"error": "No browser connected"})
+        return orjson.dumps({"error": "No browser connected"}).decode()
     
     analysis = await page.evaluate("""() => {
         // Detect if it's a search results page
@@ -111,7 +124,8 @@ async def analyze_page() -> str:
         // Extract search result links
         const results = [];
         document.querySelectorAll('a').forEach((link, idx) => {
-            const text = link.innerText?.trim() || '';
+            // textContent: no forced layout per link, unlike innerText; collapse markup whitespace
+            const text = (link.textContent || '').replace(/\\s+/g, ' ').trim();
             const href = link.href || '';
             const parent = link.closest('li, .result, .search-result');
             
@@ -121,7 +135,7 @@ async def analyze_page() -> str:
                     index: idx,
                     title: text.slice(0, 100),
                     url: href,
-                    snippet: parent.innerText?.slice(0, 200) || ''
+                    snippet: parent.textContent?.slice(0, 300).replace(/\\s+/g, ' ').trim().slice(0, 200) || ''
                 });
             }
         });
@@ -133,7 +147,7 @@ async def analyze_page() -> str:
         };
     }""")
     
-    return json.dumps(analysis)
+    return orjson.dumps(analysis).decode()
 
 
 @mcp.tool()
@@ -142,29 +156,43 @@ async def click_best_result(search_term: str) -> str:
     if not page:
         return "No browser connected"
     
-    # Get analysis
-    analysis_str = await analyze_page()
-    analysis = json.loads(analysis_str)
+    # Detect, extract and score in one evaluate — only the winning link crosses CDP
+    analysis = await page.evaluate("""(searchTerm) => {
+        const hasResults = document.querySelectorAll('ol li, ul li, .result, .search-result').length > 3;
+        const hasSearchBox = document.querySelector('input[type="search"], input[name*="search"], input[name*="query"]') !== null;
+        if (!(hasResults && hasSearchBox)) return { isSearchPage: false };
+        
+        // Same filter and top-10 cut as analyze_page, scored by search words present (simple keyword matching)
+        const words = searchTerm.toLowerCase().split(/\\s+/).filter(Boolean);
+        const links = document.querySelectorAll('a');
+        let resultCount = 0, best = null, bestScore = 0;
+        for (let i = 0; i < links.length && resultCount < 10; i++) {
+            const link = links[i];
+            const text = (link.textContent || '').replace(/\\s+/g, ' ').trim();
+            const href = link.href || '';
+            const parent = link.closest('li, .result, .search-result');
+            if (text.length <= 20 || !href.startsWith('http') || !parent) continue;
+            resultCount++;
+            
+            const title = text.slice(0, 100);
+            const snippet = parent.textContent?.slice(0, 300).replace(/\\s+/g, ' ').trim().slice(0, 200) || '';
+            const haystack = (title + ' ' + snippet).toLowerCase();
+            const score = words.filter(word => haystack.includes(word)).length;
+            if (score > bestScore) {
+                bestScore = score;
+                best = { title, url: href };
+            }
+        }
+        return { isSearchPage: true, resultCount, best };
+    }""", search_term)
     
-    if not analysis.get('isSearchPage'):
+    if not analysis['isSearchPage']:
         return "Not a search results page"
     
-    results = analysis.get('results', [])
-    if not results:
+    if not analysis['resultCount']:
         return "No results found"
     
-    # Find best match (simple keyword matching)
-    search_lower = search_term.lower()
-    best_match = None
-    best_score = 0
-    
-    for result in results:
-        text = (result['title'] + ' ' + result['snippet']).lower()
-        score = sum(1 for word in search_lower.split() if word in text)
-        if score > best_score:
-            best_score = score
-            best_match = result
-    
+    best_match = analysis['best']
     if best_match:
         await page.goto(best_match['url'])
         return f"Clicked: {best_match['title']}"
@@ -180,7 +208,7 @@ def save_task(name: str, url: str, instruction: str, actions: str) -> str:
         "name": name,
         "url": url,
         "instruction": instruction,
-        "actions": json.loads(actions)
+        "actions": orjson.loads(actions)
     })
     save_tasks(tasks)
     return f"Saved task: {name}"
@@ -207,7 +235,7 @@ async def execute_task(name: str) -> str:
             result = await wait_for_element(action.get('selector', 'body'))
         results.append(result)
     
-    return json.dumps(results)
+    return orjson.dumps(results).decode()
 
 
 if __name__ == "__main__":
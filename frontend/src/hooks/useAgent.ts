@@ -5,6 +5,7 @@ const API_BASE = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 
 interface ConnectRequest {
   url: string;
+  session_id?: string;
 }
 
 interface PlanRequest {
@@ -15,10 +16,12 @@ interface PlanRequest {
 interface ExecuteRequest {
   actions: string;
   url: string;
+  session_id?: string;
 }
 
 interface SimplifyRequest {
   url: string;
+  session_id?: string;
 }
 
 export const useConnect = () => {